@@ -6,6 +6,12 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import streamlit as st
 from scripts.judge_legacy import judge  # さっき作った judge() を import
 
+# 再実行のたびに同じ入力で judge（RxNav 呼び出し含む）を繰り返さないようにキャッシュ。
+# 判定には RxNav の「見つからない」結果も含まれるので、RxNav キャッシュの短い方（1日）で期限切れにし、件数も上限を設ける
+@st.cache_data(show_spinner=False, ttl=24 * 3600, max_entries=1024)
+def cached_judge(term, sport_code, period, route, dose_24h):
+    return judge(term=term, sport_code=sport_code, period=period, route=route, dose_24h=dose_24h)
+
 st.title("Anti-Doping Judge (Step-by-step)")
 
 # 1) 初期入力
@@ -25,7 +31,7 @@ if st.button("Start / Retry"):
 ctx = st.session_state.ctx
 if ctx["sport_code"] and ctx["term"]:
     # 2) judge を呼ぶ（足りない項目は None のまま）
-    res = judge(
+    res = cached_judge(
         term=ctx["term"],
         sport_code=ctx["sport_code"],
         period=ctx["period"],
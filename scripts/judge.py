@@ -1,14 +1,16 @@
+import json
 import os
 import re
-from typing import Dict, Any, List, Optional, Tuple, Set
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Dict, Any, List, Mapping, NamedTuple, Optional, Tuple, Set
 
 import pandas as pd
 
-try:
-    import requests  # 外部APIフォールバック用（任意）
-except Exception:  # requests が無い環境でも動くように
-    requests = None
-
 
 # ============================
 # 設定
@@ -38,17 +40,55 @@ FILES = {
 # ============================
 DF: Dict[str, pd.DataFrame] = {}
 
+# 6つのINN直指定CSV（判定の優先順）
+INN_TABLES = [
+    "always_green", "always_red",
+    "ask_route_and_dose", "ask_period",
+    "ask_period_and_route", "ask_period_and_urine_caution",
+]
+
+class InnRecord(NamedTuple):
+    table: str              # DF のキー（INN_TABLES / "cache_sub" / "cache_prod" のいずれか）
+    row: Dict[str, Any]     # CSV の1行（列名 → 値）
+
+# 正規化名/別名 → 行 の検索インデックス（load_data で構築）
+INN_DISPATCH: Dict[str, Tuple[InnRecord, ...]] = {}  # 6CSV + substances_cache + product_compositions：名前 → 判定順のヒット
+SECTIONS_BY_CODE: Dict[str, Dict[str, Any]] = {}  # sections: section_code → 行
+SPORTS_BY_CODE: Dict[str, Dict[str, Any]] = {}    # sports: sport_code → 行（重複時は先頭行）
+LABEL_TO_SECTION: Dict[str, Tuple[int, str]] = {}  # classes_map: label → (行順, section)
+ALLOWED_LABELS: frozenset = frozenset()            # allowed_class: label
+
 def _csv_path(name: str) -> str:
     return os.path.join(DATA_DIR, FILES[name])
 
+@lru_cache(maxsize=None)
+def _pacsv():
+    """ 高速CSVリーダー pyarrow.csv（任意）。初めて CSV を読むときに import、無ければ None """
+    try:
+        import pyarrow.csv as pacsv
+    except Exception:  # pyarrow が無ければ pandas のリーダーを使う
+        return None
+    return pacsv
+
 def _safe_read_csv(path: str) -> pd.DataFrame:
     if not os.path.exists(path):
         return pd.DataFrame()
-    try:
-        df = pd.read_csv(path, keep_default_na=False)
-    except Exception:
-        # Excel由来BOMなどを考慮
-        df = pd.read_csv(path, keep_default_na=False, encoding="utf-8-sig")
+    df = None
+    pacsv = _pacsv()
+    if pacsv is not None:
+        try:
+            # keep_default_na=False 相当（空文字を null にしない）
+            opts = pacsv.ConvertOptions(null_values=[], strings_can_be_null=False, quoted_strings_can_be_null=False)
+            df = pacsv.read_csv(path, convert_options=opts).to_pandas()
+        except Exception:
+            # ヘッダのみのCSVなどは pandas に任せる
+            df = None
+    if df is None:
+        try:
+            df = pd.read_csv(path, keep_default_na=False)
+        except Exception:
+            # Excel由来BOMなどを考慮
+            df = pd.read_csv(path, keep_default_na=False, encoding="utf-8-sig")
     # 列名BOM/空白除去
     df.columns = (
         df.columns
@@ -58,8 +98,43 @@ def _safe_read_csv(path: str) -> pd.DataFrame:
     )
     return df
 
+def _norm_col(s: pd.Series) -> pd.Series:
+    """ .astype(str).str.lower().str.strip() を1パスで（中間Seriesを作らない） """
+    return pd.Series([x.strip().lower() for x in s.astype(str).tolist()], index=s.index)
+
+def _split_semicol_col(s: pd.Series) -> pd.Series:
+    """ ";" 区切り列 → 小文字・trim 済みリストの列（Series.apply を介さず tolist() 上の内包表記で1パス） """
+    return pd.Series(
+        [[a for a in (x.strip() for x in v.lower().split(";")) if a] for v in s.fillna("").astype(str).tolist()],
+        index=s.index, dtype=object,
+    )
+
+def _record_index(df: pd.DataFrame, key_col: str) -> Dict[str, Dict[str, Any]]:
+    """ key_col と _aliases_list の各値 → 行（dict）。重複時は先頭行を優先（旧マスク検索と同じ） """
+    idx: Dict[str, Dict[str, Any]] = {}
+    if df.empty or key_col not in df.columns:
+        return idx
+    for rec in df.to_dict("records"):
+        alias_list = rec.get("_aliases_list")
+        for k in [rec[key_col], *(alias_list if isinstance(alias_list, list) else [])]:
+            if k:
+                idx.setdefault(k, rec)
+    return idx
+
+def _build_inn_dispatch(dfs: Dict[str, pd.DataFrame]) -> Dict[str, Tuple[InnRecord, ...]]:
+    """ 名前/別名 → 判定順（6CSV → cache_sub → cache_prod）のヒット。
+    6CSV どうしはテーブルの優先順で先勝ち（1件だけ）、cache_sub / cache_prod はそれぞれ後ろに足す """
+    dispatch: Dict[str, Tuple[InnRecord, ...]] = {}
+    for name in INN_TABLES:
+        for k, rec in _record_index(dfs[name], "_inn_norm").items():
+            dispatch.setdefault(k, (InnRecord(name, rec),))
+    for name, key_col in (("cache_sub", "_inn_norm"), ("cache_prod", "_brand_norm")):
+        for k, rec in _record_index(dfs[name], key_col).items():
+            dispatch[k] = dispatch.get(k, ()) + (InnRecord(name, rec),)
+    return dispatch
+
 def load_data():
-    global DF
+    global DF, INN_DISPATCH, SECTIONS_BY_CODE, SPORTS_BY_CODE, LABEL_TO_SECTION, ALLOWED_LABELS
     for key in FILES.keys():
         DF[key] = _safe_read_csv(_csv_path(key))
 
@@ -68,17 +143,12 @@ def load_data():
         if df.empty:
             return df
         if inn_col in df.columns:
-            df["_inn_norm"] = df[inn_col].astype(str).str.lower().str.strip()
+            df["_inn_norm"] = _norm_col(df[inn_col])
         if "aliases" in df.columns:
-            df["_aliases_list"] = df["aliases"].fillna("").astype(str).str.lower().apply(
-                lambda s: [a.strip() for a in s.split(";") if a.strip()]
-            )
+            df["_aliases_list"] = _split_semicol_col(df["aliases"])
         return df
 
-    for name in ["always_green", "always_red",
-                 "ask_route_and_dose", "ask_period",
-                 "ask_period_and_route", "ask_period_and_urine_caution",
-                 "cache_sub"]:
+    for name in INN_TABLES + ["cache_sub"]:
         if not DF[name].empty:
             inn_col = "inn" if "inn" in DF[name].columns else None
             if inn_col:
@@ -91,10 +161,8 @@ def load_data():
         for col in ["brand_name", "list_name", "aliases"]:
             if col not in dfp.columns:
                 dfp[col] = ""
-        DF["cache_prod"]["_brand_norm"] = dfp["brand_name"].astype(str).str.lower().str.strip()
-        DF["cache_prod"]["_aliases_list"] = dfp["aliases"].fillna("").astype(str).str.lower().apply(
-            lambda s: [a.strip() for a in s.split(";") if a.strip()]
-        )
+        DF["cache_prod"]["_brand_norm"] = _norm_col(dfp["brand_name"])
+        DF["cache_prod"]["_aliases_list"] = _split_semicol_col(dfp["aliases"])
 
     # sections（S9ルート判定に使用）
     if not DF["sections"].empty:
@@ -103,19 +171,15 @@ def load_data():
             if col not in DF["sections"].columns:
                 DF["sections"][col] = ""
         # セミコロンをリスト化
-        DF["sections"]["_prohibited_routes"] = DF["sections"]["prohibited_route"].fillna("").astype(str).apply(
-            lambda s: [x.strip().lower() for x in s.split(";") if str(x).strip()]
-        )
-        DF["sections"]["_permitted_routes"] = DF["sections"]["permitted_route"].fillna("").astype(str).apply(
-            lambda s: [x.strip().lower() for x in s.split(";") if str(x).strip()]
-        )
+        DF["sections"]["_prohibited_routes"] = _split_semicol_col(DF["sections"]["prohibited_route"])
+        DF["sections"]["_permitted_routes"] = _split_semicol_col(DF["sections"]["permitted_route"])
 
     # classes_map / allowed_class 正規化
     if not DF["classes_map"].empty:
         for col in ["source_system", "source_id", "source_label", "mapped_section_code"]:
             if col not in DF["classes_map"].columns:
                 DF["classes_map"][col] = ""
-        DF["classes_map"]["_label_norm"] = DF["classes_map"]["source_label"].astype(str).str.lower().str.strip()
+        DF["classes_map"]["_label_norm"] = _norm_col(DF["classes_map"]["source_label"])
         DF["classes_map"]["_key_norm"] = (
             DF["classes_map"]["source_system"].astype(str).str.strip() + ":" +
             DF["classes_map"]["source_id"].astype(str).str.strip()
@@ -125,12 +189,29 @@ def load_data():
         for col in ["source_system", "source_id", "source_label"]:
             if col not in DF["allowed_class"].columns:
                 DF["allowed_class"][col] = ""
-        DF["allowed_class"]["_label_norm"] = DF["allowed_class"]["source_label"].astype(str).str.lower().str.strip()
+        DF["allowed_class"]["_label_norm"] = _norm_col(DF["allowed_class"]["source_label"])
         DF["allowed_class"]["_key_norm"] = (
             DF["allowed_class"]["source_system"].astype(str).str.strip() + ":" +
             DF["allowed_class"]["source_id"].astype(str).str.strip()
         ).str.lower()
 
+    # 低カーディナリティのコード列は正規化済みの category にしておく（比較は codes 上で済む）
+    for name, col in [("sections", "section_code"), ("sports", "sport_code")]:
+        if col in DF[name].columns:
+            DF[name][col] = DF[name][col].astype(str).str.strip().str.upper().astype("category")
+
+    # 検索インデックス
+    INN_DISPATCH = _build_inn_dispatch(DF)
+    SECTIONS_BY_CODE = _record_index(DF["sections"], "section_code")
+    SPORTS_BY_CODE = _record_index(DF["sports"], "sport_code")
+
+    LABEL_TO_SECTION = {}
+    if not DF["classes_map"].empty:
+        cm = DF["classes_map"]
+        for i, (lab, sec) in enumerate(zip(cm["_label_norm"], cm["mapped_section_code"])):
+            LABEL_TO_SECTION.setdefault(lab, (i, str(sec).strip().upper()))
+    ALLOWED_LABELS = frozenset(DF["allowed_class"]["_label_norm"]) if not DF["allowed_class"].empty else frozenset()
+
 
 # 初期ロード
 load_data()
@@ -139,6 +220,7 @@ load_data()
 # ============================
 # ユーティリティ
 # ============================
+@lru_cache(maxsize=8192)
 def _norm(s: Optional[str]) -> str:
     return (s or "").strip().lower()
 
@@ -151,179 +233,152 @@ def _ask(need: List[Dict[str, Any]], provisional_color: str, reason: str) -> Dic
 def _split_semicol(s: str) -> List[str]:
     return [x.strip().lower() for x in str(s).split(";") if str(x).strip()]
 
-def _match_inn(df: pd.DataFrame, term_norm: str) -> pd.DataFrame:
-    if df.empty:
-        return df
-    m = pd.Series([False]*len(df))
-    if "_inn_norm" in df.columns:
-        m = m | (df["_inn_norm"] == term_norm)
-    if "_aliases_list" in df.columns:
-        m = m | df["_aliases_list"].apply(lambda lst: term_norm in lst if isinstance(lst, list) else False)
-    return df[m]
-
+# 投与経路の正規化辞書（増やしてOK）。呼び出しごとに作り直さないようモジュールで1つだけ持つ
+_ROUTE_ALIAS: Mapping[str, str] = MappingProxyType({
+    "nasal": "intranasal",
+    "nose": "intranasal",
+    "skin": "dermal",
+    "eye": "ophthalmic",
+    "ear": "otic",
+    "mouth": "oromucosal",
+    "buccal": "oromucosal",
+    "gingival": "oromucosal",
+    "sublingual": "oromucosal",
+    "topical": "topical",
+    "inhalation": "inhaled",
+    "inhaled": "inhaled",
+    "rectum": "rectal",
+    "oral": "oral",
+    "po": "oral",
+    "iv": "injectable",
+    "im": "injectable",
+    "sc": "injectable",
+    "injectable": "injectable",
+    "perianal": "perianal",
+    "ophthalmological": "ophthalmic",
+    "dental-intracanal": "dental-intracanal",
+})
+
+@lru_cache(maxsize=64)
 def _canonical_route(route: Optional[str]) -> Optional[str]:
     if not route:
         return None
     r = _norm(route)
-    # 正規化辞書（増やしてOK）
-    alias = {
-        "nasal": "intranasal",
-        "nose": "intranasal",
-        "skin": "dermal",
-        "eye": "ophthalmic",
-        "ear": "otic",
-        "mouth": "oromucosal",
-        "buccal": "oromucosal",
-        "gingival": "oromucosal",
-        "sublingual": "oromucosal",
-        "topical": "topical",
-        "inhalation": "inhaled",
-        "inhaled": "inhaled",
-        "rectum": "rectal",
-        "oral": "oral",
-        "po": "oral",
-        "iv": "injectable",
-        "im": "injectable",
-        "sc": "injectable",
-        "injectable": "injectable",
-        "perianal": "perianal",
-        "ophthalmological": "ophthalmic",
-        "dental-intracanal": "dental-intracanal",
-    }
-    return alias.get(r, r)
+    return _ROUTE_ALIAS.get(r, r)
 
+@lru_cache(maxsize=64)
 def _ensure_period(period: Optional[str]) -> Optional[str]:
     if not period:
         return None
     p = _norm(period)
     return "in" if p in ("in", "in-comp", "incompetition", "in_comp", "comp") else ("out" if p in ("out", "out-comp", "out_comp") else None)
 
+def _sport_period_rule(sport_code: str) -> str:
+    """ sports_rules の P1 期間ルール（'both' or 'in' を想定）。未登録の競技は 'in' """
+    rs = SPORTS_BY_CODE.get(sport_code.upper())
+    return str(rs.get("prohibited_period", "in")).strip().lower() if rs else "in"
+
 
 # ============================
 # 6つのCSV（INN直指定）で判定
 # ============================
-def _judge_by_6csv(term_norm: str, sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float]) -> Optional[Dict[str, Any]]:
-    # 1) always_green
-    row = _match_inn(DF["always_green"], term_norm)
-    if not row.empty:
-        sec = row.iloc[0].get("section_code", "")
-        return _out("green", f"Always allowed{f' ({sec})' if sec else ''}.")
-
-    # 2) always_red
-    row = _match_inn(DF["always_red"], term_norm)
-    if not row.empty:
-        sec = row.iloc[0].get("section_code", "")
-        return _out("red", f"Always prohibited{f' ({sec})' if sec else ''}.")
-
-    # 3) ask_route_and_dose（S3の特定β2作動薬など）
-    row = _match_inn(DF["ask_route_and_dose"], term_norm)
-    if not row.empty:
-        r = row.iloc[0]
-        permitted_routes = _split_semicol(r.get("permitted_route", ""))
-        prohibited_routes = _split_semicol(r.get("prohibited_route", ""))
+# 1) always_green
+def _judge_always_green(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Dict[str, Any]:
+    sec = r.get("section_code", "")
+    return _out("green", f"Always allowed{f' ({sec})' if sec else ''}.")
+
+# 2) always_red
+def _judge_always_red(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Dict[str, Any]:
+    sec = r.get("section_code", "")
+    return _out("red", f"Always prohibited{f' ({sec})' if sec else ''}.")
+
+# 3) ask_route_and_dose（S3の特定β2作動薬など）
+def _judge_route_and_dose(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Dict[str, Any]:
+    permitted_routes = _split_semicol(r.get("permitted_route", ""))
+    prohibited_routes = _split_semicol(r.get("prohibited_route", ""))
+    max_dose = None
+    try:
+        max_dose = float(str(r.get("maximum_dose", "")).strip()) if str(r.get("maximum_dose", "")).strip() != "" else None
+    except Exception:
         max_dose = None
-        try:
-            max_dose = float(str(r.get("maximum_dose", "")).strip()) if str(r.get("maximum_dose", "")).strip() != "" else None
-        except Exception:
-            max_dose = None
 
-        asks = []
-        if route is None:
-            opts = list(set((permitted_routes or []) + (prohibited_routes or [])))
-            asks.append({"field": "route", "options": opts or ["inhaled","oral","injectable","topical","nasal","ophthalmic","otic","rectal","oromucosal"], "hint": "Select route"})
-        if max_dose is not None and dose_24h is None:
-            asks.append({"field": "dose_24h", "hint": f"24h total dose (max {max_dose})"})
+    asks = []
+    if route is None:
+        opts = list(set((permitted_routes or []) + (prohibited_routes or [])))
+        asks.append({"field": "route", "options": opts or ["inhaled","oral","injectable","topical","nasal","ophthalmic","otic","rectal","oromucosal"], "hint": "Select route"})
+    if max_dose is not None and dose_24h is None:
+        asks.append({"field": "dose_24h", "hint": f"24h total dose (max {max_dose})"})
 
-        if asks:
-            return _ask(asks, "yellow", "Route and/or dose required.")
+    if asks:
+        return _ask(asks, "yellow", "Route and/or dose required.")
 
-        # route/dose が揃っていれば評価
-        rt = _canonical_route(route)
-        if prohibited_routes and rt in prohibited_routes:
-            return _out("red", "Prohibited by route.")
-        if permitted_routes and rt not in permitted_routes:
-            # 想定外の経路は安全側で赤
-            return _out("red", "Unsupported route for this substance.")
-
-        if max_dose is not None:
-            try:
-                if float(dose_24h) > max_dose:
-                    return _out("red", f"Dose exceeds limit ({dose_24h} > {max_dose}).")
-            except Exception:
-                return _ask([{"field":"dose_24h","hint":f"24h total dose (max {max_dose})"}], "yellow", "Dose required.")
-        return _out("green", "Within permitted route/dose.")
-
-    # 4) ask_period（S6/S7/S8 の多く）
-    row = _match_inn(DF["ask_period"], term_norm)
-    if not row.empty:
-        p = _ensure_period(period)
-        if not p:
-            return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "Period required.")
-        color = "red" if p == "in" else "green"
-        sec = row.iloc[0].get("section_code", "")
-        return _out(color, f"{sec} period rule.")
-
-    # 5) ask_period_and_route（S9 や一部例外）
-    row = _match_inn(DF["ask_period_and_route"], term_norm)
-    if not row.empty:
-        # 期間 → 経路の順に
-        p = _ensure_period(period)
-        if not p:
-            return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "Period required.")
-        r = row.iloc[0]
-        permitted_routes = _split_semicol(r.get("permitted_route", ""))
-        prohibited_routes = _split_semicol(r.get("prohibited_route", ""))
-
-        # inn側に指定が無ければ、sections(S9)の既定を参照
-        if not permitted_routes and not prohibited_routes:
-            s9 = DF["sections"][DF["sections"]["section_code"].astype(str).str.upper()=="S9"]
-            if not s9.empty:
-                permitted_routes = s9.iloc[0]["_permitted_routes"]
-                prohibited_routes = s9.iloc[0]["_prohibited_routes"]
+    # route/dose が揃っていれば評価
+    rt = _canonical_route(route)
+    if prohibited_routes and rt in prohibited_routes:
+        return _out("red", "Prohibited by route.")
+    if permitted_routes and rt not in permitted_routes:
+        # 想定外の経路は安全側で赤
+        return _out("red", "Unsupported route for this substance.")
 
-        if p == "out":
-            return _out("green", "Out-of-competition permitted.")
-        # in の場合、route が必要
-        if route is None:
-            opts = list(set((permitted_routes or []) + (prohibited_routes or [])))
-            return _ask([{"field":"route","options": opts or ["inhaled","oral","injectable","rectal","oromucosal","nasal","topical","ophthalmic","otic","perianal","dental-intracanal"],"hint":"Select route"}], "yellow", "Route required.")
-        rt = _canonical_route(route)
-        if rt in prohibited_routes:
-            return _out("red", "Prohibited route in-competition.")
-        return _out("green", "Permitted route in-competition.")
+    if max_dose is not None:
+        try:
+            if float(dose_24h) > max_dose:
+                return _out("red", f"Dose exceeds limit ({dose_24h} > {max_dose}).")
+        except Exception:
+            return _ask([{"field":"dose_24h","hint":f"24h total dose (max {max_dose})"}], "yellow", "Dose required.")
+    return _out("green", "Within permitted route/dose.")
 
-    # 6) ask_period_and_urine_caution（S6.Bの閾値系など）
-    row = _match_inn(DF["ask_period_and_urine_caution"], term_norm)
-    if not row.empty:
-        p = _ensure_period(period)
-        if not p:
-            return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "Period required.")
-        if p == "in":
-            return _out("yellow", "Urine threshold caution applies in-competition.")
+# 4) ask_period（S6/S7/S8 の多く）
+def _judge_period(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Dict[str, Any]:
+    p = _ensure_period(period)
+    if not p:
+        return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "Period required.")
+    color = "red" if p == "in" else "green"
+    sec = r.get("section_code", "")
+    return _out(color, f"{sec} period rule.")
+
+# 5) ask_period_and_route（S9 や一部例外）
+def _judge_period_and_route(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Dict[str, Any]:
+    # 期間 → 経路の順に
+    p = _ensure_period(period)
+    if not p:
+        return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "Period required.")
+    permitted_routes = _split_semicol(r.get("permitted_route", ""))
+    prohibited_routes = _split_semicol(r.get("prohibited_route", ""))
+
+    # inn側に指定が無ければ、sections(S9)の既定を参照
+    if not permitted_routes and not prohibited_routes:
+        s9 = SECTIONS_BY_CODE.get("S9")
+        if s9:
+            permitted_routes = s9["_permitted_routes"]
+            prohibited_routes = s9["_prohibited_routes"]
+
+    if p == "out":
         return _out("green", "Out-of-competition permitted.")
-    return None
+    # in の場合、route が必要
+    if route is None:
+        opts = list(set((permitted_routes or []) + (prohibited_routes or [])))
+        return _ask([{"field":"route","options": opts or ["inhaled","oral","injectable","rectal","oromucosal","nasal","topical","ophthalmic","otic","perianal","dental-intracanal"],"hint":"Select route"}], "yellow", "Route required.")
+    rt = _canonical_route(route)
+    if rt in prohibited_routes:
+        return _out("red", "Prohibited route in-competition.")
+    return _out("green", "Permitted route in-competition.")
+
+# 6) ask_period_and_urine_caution（S6.Bの閾値系など）
+def _judge_period_and_urine(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Dict[str, Any]:
+    p = _ensure_period(period)
+    if not p:
+        return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "Period required.")
+    if p == "in":
+        return _out("yellow", "Urine threshold caution applies in-competition.")
+    return _out("green", "Out-of-competition permitted.")
+
 
 
 # ============================
 # substances_cache で判定
 # ============================
-def _judge_by_cache(term_norm: str, sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float]) -> Optional[Dict[str, Any]]:
-    dfc = DF["cache_sub"]
-    if dfc.empty:
-        return None
-    # マッチ（inn / aliases）
-    m = pd.Series([False]*len(dfc))
-    if "inn" in dfc.columns:
-        m = m | (dfc["inn"].astype(str).str.lower().str.strip() == term_norm)
-    if "aliases" in dfc.columns:
-        m = m | dfc["aliases"].fillna("").astype(str).str.lower().apply(
-            lambda s: term_norm in [a.strip() for a in s.split(";") if a.strip()]
-        )
-    row = dfc[m]
-    if row.empty:
-        return None
-
-    r = row.iloc[0]
+def _judge_by_cache(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Optional[Dict[str, Any]]:
     sec = str(r.get("mapped_section_code","")).strip().upper()  # S1..S9, P1, ALLOWED, S0
     if not sec:
         return None
@@ -339,13 +394,7 @@ def _judge_by_cache(term_norm: str, sport_code: str, period: Optional[str], rout
     # P1（βブロッカー：競技別）
     if sec == "P1":
         # スポーツ規則参照
-        dfs = DF["sports"]
-        period_rule = "in"  # 既定
-        if not dfs.empty and "sport_code" in dfs.columns:
-            rs = dfs[dfs["sport_code"].astype(str).str.strip().str.upper() == sport_code.upper()]
-            if not rs.empty:
-                # 'both' or 'in' を想定
-                period_rule = str(rs.iloc[0].get("prohibited_period", "in")).strip().lower()
+        period_rule = _sport_period_rule(sport_code)
         p = _ensure_period(period)
         if period_rule == "both":
             return _out("red", "P1 prohibited in this sport (both).")
@@ -372,12 +421,9 @@ def _judge_by_cache(term_norm: str, sport_code: str, period: Optional[str], rout
         if not p:
             return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "S9 period required.")
         # sections.csv からS9の既定ルート集合
-        s9 = DF["sections"][DF["sections"]["section_code"].astype(str).str.upper()=="S9"]
-        permitted_routes: List[str] = []
-        prohibited_routes: List[str] = []
-        if not s9.empty:
-            permitted_routes = s9.iloc[0]["_permitted_routes"]
-            prohibited_routes = s9.iloc[0]["_prohibited_routes"]
+        s9 = SECTIONS_BY_CODE.get("S9", {})
+        permitted_routes: List[str] = s9.get("_permitted_routes", [])
+        prohibited_routes: List[str] = s9.get("_prohibited_routes", [])
         if p == "out":
             return _out("green", "S9 out-of-competition permitted (within label).")
         # in の場合
@@ -395,19 +441,8 @@ def _judge_by_cache(term_norm: str, sport_code: str, period: Optional[str], rout
 # ============================
 # ブランド → 成分分解（キャッシュ）
 # ============================
-def _judge_by_brand_cache(term_norm: str, sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Optional[Dict[str, Any]]:
-    dfp = DF["cache_prod"]
-    if dfp.empty:
-        return None
-    # brand / aliases マッチ
-    row = dfp[
-        (dfp["_brand_norm"] == term_norm) |
-        (dfp["_aliases_list"].apply(lambda lst: term_norm in lst if isinstance(lst, list) else False))
-    ]
-    if row.empty:
-        return None
-
-    inns = _split_semicol(row.iloc[0].get("list_name",""))
+def _judge_by_brand_cache(r: Dict[str, Any], sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Optional[Dict[str, Any]]:
+    inns = _split_semicol(r.get("list_name",""))
     if not inns:
         return None
 
@@ -436,74 +471,202 @@ def _judge_by_brand_cache(term_norm: str, sport_code: str, period: Optional[str]
     return _out("green", " / ".join(reasons) if reasons else "All components allowed")
 
 
+# テーブル → 判定関数（INN_DISPATCH のヒットを該当ハンドラへ直行させる。None なら次のヒットへ）
+DISPATCH: Dict[str, Callable[[Dict[str, Any], str, Optional[str], Optional[str], Optional[float], int], Optional[Dict[str, Any]]]] = {
+    "always_green": _judge_always_green,
+    "always_red": _judge_always_red,
+    "ask_route_and_dose": _judge_route_and_dose,
+    "ask_period": _judge_period,
+    "ask_period_and_route": _judge_period_and_route,
+    "ask_period_and_urine_caution": _judge_period_and_urine,
+    "cache_sub": _judge_by_cache,
+    "cache_prod": _judge_by_brand_cache,
+}
+
+
 # ============================
 # 外部API（RxNorm/RxClass）フォールバック（任意）
 # ============================
 RXNAV = "https://rxnav.nlm.nih.gov/REST"
 
-def _rxnorm_find_rxcui(name: str) -> Optional[str]:
-    if requests is None:
+# requests（外部APIフォールバック用・任意）は初回の外部照会まで import しない（CSV だけで済む判定の起動を軽く）
+SESSION = None             # RxNav 用セッション（_session() が作成）
+_requests_missing = False  # requests が無い環境では外部照会をしない
+_session_lock = threading.Lock()
+
+def _session():
+    """ RxNav 用の接続プール付きセッション（keep-alive で TLS ハンドシェイクを使い回す）。requests が無ければ None """
+    global SESSION, _requests_missing
+    if SESSION is None and not _requests_missing:
+        with _session_lock:
+            if SESSION is None and not _requests_missing:
+                try:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from urllib3.util.retry import Retry
+                except Exception:
+                    _requests_missing = True
+                    return None
+                s = requests.Session()
+                # 再試行は 429/5xx の応答だけ（read タイムアウトは再試行しない・接続失敗は1回まで）
+                retry = Retry(total=3, connect=1, read=0, backoff_factor=0.3, status_forcelist=(429, 502, 503, 504))
+                s.mount("https://", HTTPAdapter(pool_maxsize=32, max_retries=retry))
+                SESSION = s
+    return SESSION
+
+# RxNav 結果のディスクキャッシュ（sqlite）。CLEATHLETE_RXNAV_CACHE にパスを指定したときだけ有効（既定はプロセス内のみ）
+RXNAV_CACHE_PATH = os.environ.get("CLEATHLETE_RXNAV_CACHE", "")
+RXNAV_CACHE_TTL = 7 * 24 * 3600      # 秒
+RXNAV_NEG_CACHE_TTL = 24 * 3600      # 「見つからない」結果は短めに保持
+RXNAV_MEMO_MAX = 4096                # プロセス内キャッシュの最大件数（古いものから捨てる）
+RXNAV_MAX_WORKERS = 8            # 合剤成分の並行判定数
+
+_cache_conn: Optional[sqlite3.Connection] = None
+_cache_lock = threading.Lock()
+# プロセス内キャッシュ：key → (value, fetched_at)。期限はディスクと同じく読み出し時に判定
+_memo: Dict[str, Tuple[Any, float]] = {}
+
+def _cache_db() -> Optional[sqlite3.Connection]:
+    global _cache_conn
+    if not RXNAV_CACHE_PATH:
         return None
-    q = name.strip()
-    try:
-        r = requests.get(f"{RXNAV}/rxcui.json", params={"name": q, "search": 2}, timeout=10)
-        ids = (r.json().get("idGroup", {}) or {}).get("rxnormId") or []
-        if ids:
-            return ids[0]
+    if _cache_conn is None:
+        conn = sqlite3.connect(RXNAV_CACHE_PATH, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS rxnav (key TEXT PRIMARY KEY, value TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        _cache_conn = conn
+    return _cache_conn
+
+_MISS = object()  # キャッシュ無し（None / [] は「見つからない」という結果としてキャッシュされる）
+
+def _expired(value: Any, fetched_at: float) -> bool:
+    return time.time() - fetched_at > (RXNAV_CACHE_TTL if value else RXNAV_NEG_CACHE_TTL)
+
+def _memo_put(key: str, value: Any, fetched_at: float) -> None:
+    # 呼び出し側で _cache_lock を保持していること
+    _memo.pop(key, None)
+    while len(_memo) >= RXNAV_MEMO_MAX:
+        _memo.pop(next(iter(_memo)))
+    _memo[key] = (value, fetched_at)
+
+def _cache_get(key: str) -> Any:
+    """ 期限内のキャッシュ値（プロセス内 → sqlite の順。JSON復元済み）。無し/期限切れ/DBエラーは _MISS """
+    with _cache_lock:
+        hit = _memo.get(key)
+        if hit is not None and not _expired(*hit):
+            return hit[0]
+        try:
+            db = _cache_db()
+            row = db.execute("SELECT value, fetched_at FROM rxnav WHERE key = ?", (key,)).fetchone() if db else None
+        except sqlite3.Error:
+            return _MISS
+        if row is None:
+            return _MISS
+        value = json.loads(row[0])
+        if _expired(value, row[1]):
+            return _MISS
+        _memo_put(key, value, row[1])
+        return value
+
+def _cache_put(key: str, value: Any) -> None:
+    now = time.time()
+    with _cache_lock:
+        _memo_put(key, value, now)
+        try:
+            db = _cache_db()
+            if db is None:
+                return
+            with db:
+                db.execute("INSERT OR REPLACE INTO rxnav (key, value, fetched_at) VALUES (?, ?, ?)",
+                           (key, json.dumps(value, ensure_ascii=False), now))
+        except sqlite3.Error:
+            pass  # キャッシュに書けなくても判定は続行
+
+# 各 RxNav 問い合わせは _cache_get/_cache_put（プロセス内＋sqlite、TTL 付き）で重複排除。
+# 通信エラーは例外のまま外へ出しキャッシュに残さない → 公開側の関数で握りつぶす（返り値は共有なので公開側でコピー）
+def _fetch_rxcui(q: str) -> Optional[str]:
+    key = f"rxcui:{q}"
+    cached = _cache_get(key)
+    if cached is not _MISS:
+        return cached
+    r = _session().get(f"{RXNAV}/rxcui.json", params={"name": q, "search": 2}, timeout=10)
+    ids = (r.json().get("idGroup", {}) or {}).get("rxnormId") or []
+    if ids:
+        rxcui = ids[0]
+    else:
         # approximate
-        r = requests.get(f"{RXNAV}/approximateTerm.json", params={"term": q, "maxEntries": 1}, timeout=10)
+        r = _session().get(f"{RXNAV}/approximateTerm.json", params={"term": q, "maxEntries": 1}, timeout=10)
         cand = (r.json().get("approximateGroup", {}) or {}).get("candidate") or []
-        return cand[0]["rxcui"] if cand else None
+        rxcui = cand[0]["rxcui"] if cand else None
+    _cache_put(key, rxcui)
+    return rxcui
+
+def _fetch_related_in(rxcui: str) -> List[Dict[str, str]]:
+    key = f"related_in:{rxcui}"
+    cached = _cache_get(key)
+    if cached is not _MISS:
+        return cached
+    rel = _session().get(f"{RXNAV}/rxcui/{rxcui}/related.json", params={"tty":"IN"}, timeout=10).json()
+    out = []
+    for g in rel.get("relatedGroup", {}).get("conceptGroup", []) or []:
+        for p in g.get("conceptProperties", []) or []:
+            out.append({"inn": p["name"].lower(), "rxcui": p["rxcui"]})
+    _cache_put(key, out)
+    return out
+
+def _fetch_rxclass_labels(rxcui: str) -> List[str]:
+    key = f"rxclass_labels:{rxcui}"
+    cached = _cache_get(key)
+    if cached is not _MISS:
+        return cached
+    labels: Set[str] = set()
+    # EPC
+    epc = _session().get(f"{RXNAV}/rxclass/class/byRxcui.json", params={"rxcui": rxcui}, timeout=10).json()
+    for it in epc.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []) or []:
+        lab = (it.get("rxclassMinConceptItem", {}) or {}).get("className", "")
+        if lab:
+            labels.add(lab.lower().strip())
+    # MoA など別エンドポイントの追加は運用で拡張可
+    out = sorted(labels)
+    _cache_put(key, out)
+    return out
+
+def _rxnorm_find_rxcui(name: str) -> Optional[str]:
+    if _session() is None:
+        return None
+    try:
+        return _fetch_rxcui(name.strip())
     except Exception:
         return None
 
 def _rxnorm_related_in(rxcui: str) -> List[Dict[str, str]]:
-    if requests is None:
+    if _session() is None:
         return []
     try:
-        rel = requests.get(f"{RXNAV}/rxcui/{rxcui}/related.json", params={"tty":"IN"}, timeout=10).json()
-        out = []
-        for g in rel.get("relatedGroup", {}).get("conceptGroup", []) or []:
-            for p in g.get("conceptProperties", []) or []:
-                out.append({"inn": p["name"].lower(), "rxcui": p["rxcui"]})
-        return out
+        return [dict(it) for it in _fetch_related_in(rxcui)]
     except Exception:
         return []
 
 def _rxclass_labels_by_rxcui(rxcui: str) -> List[str]:
     """ RxClass から EPC / MoA の label を集める（小文字）"""
-    if requests is None:
+    if _session() is None:
         return []
-    labels: Set[str] = set()
     try:
-        # EPC
-        epc = requests.get(f"{RXNAV}/rxclass/class/byRxcui.json", params={"rxcui": rxcui}, timeout=10).json()
-        for it in epc.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []) or []:
-            lab = (it.get("rxclassMinConceptItem", {}) or {}).get("className", "")
-            if lab:
-                labels.add(lab.lower().strip())
+        return list(_fetch_rxclass_labels(rxcui))
     except Exception:
-        pass
-    # MoA など別エンドポイントの追加は運用で拡張可
-    return list(labels)
+        return []
 
 def _map_labels_to_section(labels: List[str]) -> Optional[str]:
-    if not labels or DF["classes_map"].empty:
+    if not labels:
         return None
     # label で直接突き合わせ（小文字）
-    labs = set(lab.lower().strip() for lab in labels)
-    rows = DF["classes_map"][DF["classes_map"]["_label_norm"].isin(labs)]
-    if not rows.empty:
-        # 複数当たったらS1>S9>P1…などの優先度付けも可能。今は最初のもの。
-        return str(rows.iloc[0]["mapped_section_code"]).strip().upper()
+    hits = [LABEL_TO_SECTION[lab] for lab in set(lab.lower().strip() for lab in labels) if lab in LABEL_TO_SECTION]
+    if hits:
+        # 複数当たったらS1>S9>P1…などの優先度付けも可能。今は classes_map で最初のもの。
+        return min(hits)[1]
     return None
 
 def _labels_allowed(labels: List[str]) -> bool:
-    if DF["allowed_class"].empty or not labels:
-        return False
-    labs = set(lab.lower().strip() for lab in labels)
-    rows = DF["allowed_class"][DF["allowed_class"]["_label_norm"].isin(labs)]
-    return not rows.empty
+    return any(lab.lower().strip() in ALLOWED_LABELS for lab in labels)
 
 def _judge_by_external(term_norm: str, sport_code: str, period: Optional[str], route: Optional[str], dose_24h: Optional[float], depth: int) -> Optional[Dict[str, Any]]:
     # RxNorm → IN優先 → EPC/MoA でクラス推定 → classes_map で Sx
@@ -515,10 +678,30 @@ def _judge_by_external(term_norm: str, sport_code: str, period: Optional[str], r
     ins = _rxnorm_related_in(rxcui)
     if len(ins) >= 2:
         # 合剤 → 成分ごとに再帰
+        def _judge_in(it: Dict[str, str]) -> Dict[str, Any]:
+            return judge(it["inn"], sport_code=sport_code, period=period, route=route, dose_24h=dose_24h, _depth=depth+1)
+
+        # ローカルCSVで引ける成分を先に判定し、赤があれば RxNav を待たずに終了
+        results: Dict[int, Dict[str, Any]] = {}
+        remote: List[int] = []
+        for i, it in enumerate(ins):
+            if _norm(it["inn"]) not in INN_DISPATCH:
+                remote.append(i)
+                continue
+            res = _judge_in(it)
+            if res.get("color") == "red":
+                return res
+            results[i] = res
+        # 残りは RxNav の往復待ちが重なるようスレッドで並行実行（1件だけならその場で判定）
+        if len(remote) == 1:
+            results[remote[0]] = _judge_in(ins[remote[0]])
+        elif remote:
+            with ThreadPoolExecutor(max_workers=min(RXNAV_MAX_WORKERS, len(remote))) as ex:
+                results.update(zip(remote, ex.map(lambda i: _judge_in(ins[i]), remote)))
         reasons = []
         asks: List[Dict[str, Any]] = []
-        for it in ins:
-            res = judge(it["inn"], sport_code=sport_code, period=period, route=route, dose_24h=dose_24h, _depth=depth+1)
+        for i, it in enumerate(ins):
+            res = results[i]
             if res.get("status") == "ask":
                 asks += res["need"]
                 reasons.append(f"{it['inn']}: needs " + ", ".join(n["field"] for n in res["need"]))
@@ -559,12 +742,7 @@ def _judge_by_cachelike_section(sec: str, period: Optional[str], route: Optional
         return _out("red", "Unknown/Unapproved (S0).")
     if sec == "P1":
         # スポーツ規則
-        dfs = DF["sports"]
-        period_rule = "in"
-        if not dfs.empty and "sport_code" in dfs.columns:
-            rs = dfs[dfs["sport_code"].astype(str).str.strip().str.upper() == sport_code.upper()]
-            if not rs.empty:
-                period_rule = str(rs.iloc[0].get("prohibited_period", "in")).strip().lower()
+        period_rule = _sport_period_rule(sport_code)
         p = _ensure_period(period)
         if period_rule == "both":
             return _out("red", "P1 prohibited in this sport (both).")
@@ -582,12 +760,9 @@ def _judge_by_cachelike_section(sec: str, period: Optional[str], route: Optional
         p = _ensure_period(period)
         if not p:
             return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}], "yellow", "S9 period required.")
-        s9 = DF["sections"][DF["sections"]["section_code"].astype(str).str.upper()=="S9"]
-        permitted_routes: List[str] = []
-        prohibited_routes: List[str] = []
-        if not s9.empty:
-            permitted_routes = s9.iloc[0]["_permitted_routes"]
-            prohibited_routes = s9.iloc[0]["_prohibited_routes"]
+        s9 = SECTIONS_BY_CODE.get("S9", {})
+        permitted_routes: List[str] = s9.get("_permitted_routes", [])
+        prohibited_routes: List[str] = s9.get("_prohibited_routes", [])
         if p == "out":
             return _out("green", "S9 out-of-competition permitted (within label).")
         if route is None:
@@ -620,23 +795,15 @@ def judge(term: str, sport_code: str, period: Optional[str] = None, route: Optio
     p = _ensure_period(period)
     rt = _canonical_route(route)
 
-    # 0) 6つのCSV（INN直指定）
-    res = _judge_by_6csv(t, sport_code, p, rt, dose_24h)
-    if res is not None:
-        return res
-
-    # 1) substances_cache.csv
-    res = _judge_by_cache(t, sport_code, p, rt, dose_24h)
-    if res is not None:
-        return res
-
-    # 2) product_compositions.csv（ブランド→成分）
-    res = _judge_by_brand_cache(t, sport_code, p, rt, dose_24h, _depth)
-    if res is not None:
-        return res
+    # 0) 6つのCSV（INN直指定） → 1) substances_cache.csv → 2) product_compositions.csv（ブランド→成分）
+    # INN_DISPATCH の1回の検索で該当するヒットだけを優先順に試す
+    for hit in INN_DISPATCH.get(t, ()):
+        res = DISPATCH[hit.table](hit.row, sport_code, p, rt, dose_24h, _depth)
+        if res is not None:
+            return res
 
     # 3) 外部API（RxNorm/RxClass）フォールバック（requests が無ければ S0）
-    res = _judge_by_external(t, sport_code, p, rt, dose_24h, _depth) if requests else None
+    res = _judge_by_external(t, sport_code, p, rt, dose_24h, _depth) if _session() is not None else None
     if res is not None:
         return res
 
@@ -7,25 +7,78 @@ Flow:
  3) cache / product / API fallback
 返り値: dict {color, reason, extra_question?}
 """
+import os
 import pandas as pd
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 # --- add at top ---
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 RXNAV = "https://rxnav.nlm.nih.gov/REST"
+MAX_WORKERS = 8  # 合剤成分（RxNav 行き）の並行判定数
+MAX_DEPTH = 5    # ブランド→成分の再帰の上限
+
+# keep-alive で RxNav への接続を使い回す（1判定あたり3〜4回呼ぶため）
+# 再試行は 429/5xx の応答だけ（read タイムアウトは再試行しない・接続失敗は1回まで）
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_maxsize=32,
+                                      max_retries=Retry(total=3, connect=1, read=0, backoff_factor=0.3,
+                                                        status_forcelist=(429, 502, 503, 504))))
+
+# RxNav 応答のプロセス内キャッシュ：(url, params) → (json, fetched_at, ttl)。期限は読み出し時に判定
+RXNAV_CACHE_TTL = 7 * 24 * 3600  # 秒
+RXNAV_NEG_CACHE_TTL = 24 * 3600  # 「見つからない」応答は短めに保持
+RXNAV_MEMO_MAX = 4096            # 最大件数（古いものから捨てる）
+_memo = {}
+_memo_lock = threading.Lock()
+
+def _found(*path):
+    """JSON を path で辿った先が空でなければ「見つかった」とみなす判定関数"""
+    def check(js):
+        for k in path:
+            js = js.get(k) if isinstance(js, dict) else None
+        return bool(js)
+    return check
+
+def _has_concepts(js):
+    groups = (js.get("relatedGroup") or {}).get("conceptGroup") or []
+    return any(g.get("conceptProperties") for g in groups)
+
+def _get_json(url: str, found, **params):
+    """GET → JSON. 同じ URL+params は期限内ならプロセス内で再利用（返り値は読み取り専用で使うこと）。
+    found(json) が偽の応答は RXNAV_NEG_CACHE_TTL で期限切れ。HTTP エラーは例外のまま（キャッシュしない）"""
+    key = (url, tuple(sorted(params.items())))
+    with _memo_lock:
+        hit = _memo.get(key)
+    if hit is not None and time.time() - hit[1] <= hit[2]:
+        return hit[0]
+    r = SESSION.get(url, params=params or None, timeout=10)
+    r.raise_for_status()
+    js = r.json()
+    ttl = RXNAV_CACHE_TTL if found(js) else RXNAV_NEG_CACHE_TTL
+    with _memo_lock:
+        _memo.pop(key, None)
+        while len(_memo) >= RXNAV_MEMO_MAX:
+            _memo.pop(next(iter(_memo)))
+        _memo[key] = (js, time.time(), ttl)
+    return js
 
 def rxnorm_find_rxcui(term: str):
     """Find best Rxcui for a name (brand or ingredient)"""
     q = term.strip()
     # 1) exact-ish search
-    r = requests.get(f"{RXNAV}/rxcui.json", params={"name": q, "search": 2}, timeout=10)
-    js = r.json()
+    js = _get_json(f"{RXNAV}/rxcui.json", _found("idGroup", "rxnormId"), name=q, search=2)
     ids = js.get("idGroup", {}).get("rxnormId") or []
     if ids:
         return ids[0]
     # 2) fallback approximate
-    r = requests.get(f"{RXNAV}/approximateTerm.json", params={"term": q, "maxEntries": 1}, timeout=10)
-    cand = (r.json().get("approximateGroup", {}).get("candidate") or [])
+    js = _get_json(f"{RXNAV}/approximateTerm.json", _found("approximateGroup", "candidate"), term=q, maxEntries=1)
+    cand = (js.get("approximateGroup", {}).get("candidate") or [])
     return cand[0]["rxcui"] if cand else None
 
 def rxnorm_lookup(term: str):
@@ -40,11 +93,11 @@ def rxnorm_lookup(term: str):
         return {"kind":"none"}
 
     # what is this rxcui? get properties (TTY)
-    prop = requests.get(f"{RXNAV}/rxcui/{rxcui}/properties.json", timeout=10).json()
+    prop = _get_json(f"{RXNAV}/rxcui/{rxcui}/properties.json", _found("properties"))
     tty  = (prop.get("properties") or {}).get("tty", "")
 
     # get ingredients via has_ingredient
-    rel = requests.get(f"{RXNAV}/rxcui/{rxcui}/related.json", params={"rela":"has_ingredient"}, timeout=10).json()
+    rel = _get_json(f"{RXNAV}/rxcui/{rxcui}/related.json", _has_concepts, rela="has_ingredient")
     ingred = []
     for g in rel.get("relatedGroup", {}).get("conceptGroup", []) or []:
         for p in g.get("conceptProperties", []) or []:
@@ -54,7 +107,7 @@ def rxnorm_lookup(term: str):
     if not ingred and tty == "IN":
         # try ATC via RxClass
         atc = None
-        cls = requests.get(f"{RXNAV}/rxclass/class/byRxcui.json", params={"rxcui": rxcui}, timeout=10).json()
+        cls = _get_json(f"{RXNAV}/rxclass/class/byRxcui.json", _found("rxclassDrugInfoList", "rxclassDrugInfo"), rxcui=rxcui)
         for c in cls.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []) or []:
             cl = c.get("rxclassMinConceptItem") or {}
             if (cl.get("classType") or "").startswith("ATC"):
@@ -71,7 +124,7 @@ def rxnorm_lookup(term: str):
         ing = ingred[0]
         # pull ATC on ingredient rxcui
         atc = None
-        cls = requests.get(f"{RXNAV}/rxclass/class/byRxcui.json", params={"rxcui": ing["rxcui"]}, timeout=10).json()
+        cls = _get_json(f"{RXNAV}/rxclass/class/byRxcui.json", _found("rxclassDrugInfoList", "rxclassDrugInfo"), rxcui=ing["rxcui"])
         for c in cls.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []) or []:
             cl = c.get("rxclassMinConceptItem") or {}
             if (cl.get("classType") or "").startswith("ATC"):
@@ -84,51 +137,121 @@ def rxnorm_lookup(term: str):
 # ---------- 0. Data load ----------
 from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent.parent  # cleathlete/
+DATA_DIR = Path(os.environ.get("CLEATHLETE_LEGACY_DATA_DIR") or BASE_DIR / "data" / "csv")  # テスト等で差し替えるときは CLEATHLETE_LEGACY_DATA_DIR
 
 FILES = {
-    "green"   : BASE_DIR / "data" / "csv" / "always_green.csv",
-    "red"     : BASE_DIR / "data" / "csv" /"always_red.csv",
-    "route_dose"    : BASE_DIR / "data" / "csv" /"ask_route_and_dose.csv",
-    "period"        : BASE_DIR / "data" / "csv" /"ask_period.csv",
-    "period_route"  : BASE_DIR / "data" / "csv" /"ask_period_and_route.csv",
-    "period_urine"  : BASE_DIR / "data" / "csv" /"ask_period_and_urine_caution.csv",
-    "cache_sub"     : BASE_DIR / "data" / "csv" /"substances_cache.csv",
-    "cache_prod"    : BASE_DIR / "data" / "csv" /"product_compositions.csv",
-    "sections"      : BASE_DIR / "data" / "csv" /"sections.csv",
-    "allowed"       : BASE_DIR / "data" / "csv" /"allowed_atc_code_prefix.csv",
-    "sports"        : BASE_DIR / "data" / "csv" /"sports_rules.csv",
+    "green"   : DATA_DIR / "always_green.csv",
+    "red"     : DATA_DIR /"always_red.csv",
+    "route_dose"    : DATA_DIR /"ask_route_and_dose.csv",
+    "period"        : DATA_DIR /"ask_period.csv",
+    "period_route"  : DATA_DIR /"ask_period_and_route.csv",
+    "period_urine"  : DATA_DIR /"ask_period_and_urine_caution.csv",
+    "cache_sub"     : DATA_DIR /"substances_cache.csv",
+    "cache_prod"    : DATA_DIR /"product_compositions.csv",
+    "sections"      : DATA_DIR /"sections.csv",
+    "allowed"       : DATA_DIR /"allowed_atc_code_prefix.csv",
+    "sports"        : DATA_DIR /"sports_rules.csv",
 }
 df = {k: pd.read_csv(v, keep_default_na=False) for k, v in FILES.items()}
 
-def _split_tokens(s):
-    return [tok.strip().upper() for tok in str(s).split(";") if tok and str(tok).strip()]
+# 数値列は読み込み時に一度だけ float 化（空欄は NaN）。judge() 毎の float()/int() 変換を省く
+NUMERIC_COLS = ("maximum_dose", "urine_threshold_ng_ml")
+
+def _coerce_numeric_cols(frames):
+    for frame in frames:
+        for col in NUMERIC_COLS:
+            if col in frame.columns:
+                frame[col] = pd.to_numeric(frame[col], errors="coerce")
+
+_coerce_numeric_cols(df.values())
+
+def _explode_tokens(col):
+    """';' 区切り列を 1トークン1行に展開（大文字化・空トークン除去、元の index を保持）"""
+    tok = col.astype(str).str.upper().str.split(";").explode().str.strip()
+    return tok[tok != ""]
 
 def _build_section_prefix_index(sections_df):
-    mp = {}
-    for _, row in sections_df.iterrows():
-        sec = str(row.get("section_code","")).strip()
-        for tok in _split_tokens(row.get("atc_code_prefix","")):
-            mp[tok] = sec
-    keys = sorted(mp.keys(), key=len, reverse=True)  # 最長一致用に降順
-    return mp, keys
+    if "atc_code_prefix" not in sections_df.columns:
+        return {}
+    tok = _explode_tokens(sections_df["atc_code_prefix"])
+    sec = sections_df["section_code"].astype(str).str.strip()
+    return dict(zip(tok, sec.loc[tok.index]))
 
 def _build_allowed_prefix_index(allowed_df):
-    toks = set()
-    if "atc_code_prefix" in allowed_df.columns:
-        for v in allowed_df["atc_code_prefix"]:
-            toks.update(_split_tokens(v))
-    keys = sorted(toks, key=len, reverse=True)
-    return toks, keys
-
-SECTIONS_PREFIX_MAP, SECTIONS_PREFIXES_SORTED = _build_section_prefix_index(df["sections"])
-ALLOWED_PREFIX_SET, ALLOWED_PREFIXES_SORTED   = _build_allowed_prefix_index(df["allowed"])
+    if "atc_code_prefix" not in allowed_df.columns:
+        return set()
+    return set(_explode_tokens(allowed_df["atc_code_prefix"]))
+
+# ATC prefix の最長一致用 trie（1文字ごとの入れ子 dict、終端に値）
+_END = None
+
+def _build_prefix_trie(prefix_to_value):
+    root = {}
+    for prefix, val in prefix_to_value.items():
+        node = root
+        for ch in prefix:
+            node = node.setdefault(ch, {})
+        node[_END] = val
+    return root
+
+def _longest_prefix(trie, code):
+    """code を trie で辿り、最長一致した (prefix, 値) を返す。無ければ (None, None)"""
+    node, hit = trie, (None, None)
+    for i, ch in enumerate(code):
+        node = node.get(ch)
+        if node is None:
+            break
+        if _END in node:
+            hit = (code[:i + 1], node[_END])
+    return hit
+
+SECTIONS_PREFIX_MAP = _build_section_prefix_index(df["sections"])
+ALLOWED_PREFIX_SET  = _build_allowed_prefix_index(df["allowed"])
+SECTIONS_TRIE = _build_prefix_trie(SECTIONS_PREFIX_MAP)
+ALLOWED_TRIE  = _build_prefix_trie({p: p for p in ALLOWED_PREFIX_SET})
+
+def _build_inn_index(frame):
+    """inn → 行(dict)。同じ inn が複数あれば先頭行（従来の iloc[0] と同じ）"""
+    idx = {}
+    for rec in frame.to_dict("records"):
+        idx.setdefault(rec.get("inn"), rec)
+    return idx
+
+# judge() の毎回の列スキャンをやめ、inn で直接引く
+IDX = {k: _build_inn_index(df[k]) for k in ("green", "red", "route_dose", "period", "period_route", "period_urine", "cache_sub")}
+
+# product_compositions: brand（小文字・strip）→ 成分 INN のリスト（先頭行優先）
+def _build_brand_index(frame):
+    idx = {}
+    for brand, list_name in zip(frame["brand_name"], frame["list_name"]):
+        idx.setdefault(str(brand).lower().strip(),
+                       [s.strip().lower() for s in str(list_name).split(";") if s.strip()])
+    return idx
+
+BRAND_IDX = _build_brand_index(df["cache_prod"])
+
+# 競技コードの正規化（judge() の sport_code_norm と同じ規則）は読み込み時に1回だけ
+df["sports"]["sport_code_norm"] = df["sports"]["sport_code"].str.upper().str.replace(" ", "", regex=False).str.strip()
+# P1 競技規則: sport_code_norm → prohibited_periodo（先頭行優先）
+def _build_p1_sport_period(sports_df):
+    p1 = sports_df[sports_df["prohibited_section"] == "P1"]
+    idx = {}
+    for code, periodo in zip(p1["sport_code_norm"], p1["prohibited_periodo"]):
+        idx.setdefault(code, periodo)
+    return idx
+
+P1_SPORT_PERIOD = _build_p1_sport_period(df["sports"])
 
 # ---------- 1. Normalize ----------
-SALT_REGEX = re.compile(r'\b(hydrochloride|bromide|sulfate|tartrate|maleate|hydrate)\b', re.I)
+# 塩名と空白の連なりを 1回の sub で処理：空白を含めば ' '、塩名だけなら ''
+NORM_REGEX = re.compile(r'(?:\s|\b(?:hydrochloride|bromide|sulfate|tartrate|maleate|hydrate)\b)+', re.I)
+
+def _norm_run(m):
+    return '' if m.group().isalpha() else ' '
+
+@lru_cache(maxsize=8192)
 def norm(term: str) -> str:
-    term = term.lower().strip()
-    term = SALT_REGEX.sub('', term).strip()
-    return re.sub(r'\s+', ' ', term)
+    return NORM_REGEX.sub(_norm_run, term.lower()).strip()
 
 # ---------- 2. Core judgment ----------
 def _ask(fields, provisional="yellow", why=""):
@@ -136,53 +259,53 @@ def _ask(fields, provisional="yellow", why=""):
     return {"status":"ask", "provisional_color": provisional, "reason": why, "need": fields}
 
 
-def judge(term, sport_code="GEN", period=None, route=None, dose_24h=None):
+def judge(term, sport_code="GEN", period=None, route=None, dose_24h=None, _depth=0):
+    if _depth > MAX_DEPTH:
+        return {"status":"final","color":"red","reason":"Recursion limit reached"}
     t = norm(term)
     sport_code_norm = str(sport_code).strip().upper().replace(" ", "")
 
     # 1) always green
-    row = df["green"][df["green"]["inn"] == t]
-    if not row.empty:
+    if t in IDX["green"]:
         return {"status":"final","color":"green","reason":"Allowed by whitelist"}
 
     # 2) ask_route_and_dose (S3 β2)
-    row = df["route_dose"][df["route_dose"]["inn"] == t]
-    if not row.empty:
-        r = row.iloc[0]
+    r = IDX["route_dose"].get(t)
+    if r is not None:
         # need route?
         if not route:
-            return _ask([{"field":"route","options":[r.permitted_route],"hint":"Select administration route"}],
+            return _ask([{"field":"route","options":[r["permitted_route"]],"hint":"Select administration route"}],
                         "yellow","S3 requires route check")
         # route NG → 即赤
-        if r.permitted_route and route != r.permitted_route:
+        if r["permitted_route"] and route != r["permitted_route"]:
             return {"status":"final","color":"red","reason":"Prohibited route for S3"}
+        # 上限が未登録（空欄 → NaN）なら用量を確認できない → 安全側で赤
+        if pd.isna(r["maximum_dose"]):
+            return {"status":"final","color":"red","reason":"No 24h dose limit on record for S3; cannot verify dose"}
         # need dose?
         if dose_24h is None:
-            return _ask([{"field":"dose_24h","hint":f"24h total dose (max {r.maximum_dose} {r.dose_unit})"}],
+            return _ask([{"field":"dose_24h","hint":f"24h total dose (max {r['maximum_dose']:g} {r['dose_unit']})"}],
                         "yellow","S3 requires 24h dose check")
         # dose check
-        if float(dose_24h) > float(r.maximum_dose):
+        if float(dose_24h) > r["maximum_dose"]:
             return {"status":"final","color":"red","reason":"24h dose exceeds limit"}
         # urine caution (salbutamol/formoterol only)
-        if pd.notna(r.get("urine_threshold_ng_ml", None)):
+        if pd.notna(r.get("urine_threshold_ng_ml")):
             if period is None:
                 return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}],
                             "yellow","Urine threshold warning applies in-competition")
             if period == "in":
                 return {"status":"final","color":"yellow",
-                        "reason":f"In-competition urine > {int(r.urine_threshold_ng_ml)} ng/mL ⇒ AAF unless PK study"}
+                        "reason":f"In-competition urine > {int(r['urine_threshold_ng_ml'])} ng/mL ⇒ AAF unless PK study"}
         return {"status":"final","color":"green","reason":"Within inhaled dose limit"}
 
     # 3) ask_period (S6/S7/S8/P1)
-    row = df["period"][df["period"]["inn"] == t]
-    if not row.empty:
-        sec = row.section_code.iloc[0]
+    rec = IDX["period"].get(t)
+    if rec is not None:
+        sec = rec["section_code"]
         # β-blocker (P1) はスポーツで上書き
         if sec == "P1":
-            sr = df["sports"]
-            mask = (sr["prohibited_section"]=="P1") & (sr["sport_code"].str.upper().str.replace(" ","",regex=False)==sport_code_norm)
-            hit = sr[mask]
-            sport_periodo = hit.prohibited_periodo.iloc[0] if not hit.empty else row.prohibited_period.iloc[0]  # 'both' or 'in'
+            sport_periodo = P1_SPORT_PERIOD.get(sport_code_norm, rec["prohibited_period"])  # 'both' or 'in'
             if sport_periodo == "both":
                 return {"status":"final","color":"red","reason":"P1 beta-blocker prohibited in this sport (both)"}
             # sport_periodo == 'in' → 期間が必要
@@ -199,9 +322,8 @@ def judge(term, sport_code="GEN", period=None, route=None, dose_24h=None):
         return {"status":"final","color":color,"reason":f"{sec} period rule"}
 
     # 4) ask_period_and_route (S9, epinephrine, imidazoline etc.)
-    row = df["period_route"][df["period_route"]["inn"] == t]
-    if not row.empty:
-        pr = row.iloc[0]
+    pr = IDX["period_route"].get(t)
+    if pr is not None:
         # period 未入力ならまず期間
         if period is None:
             return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}],
@@ -210,37 +332,37 @@ def judge(term, sport_code="GEN", period=None, route=None, dose_24h=None):
             return {"status":"final","color":"green","reason":"Out-of-competition allowed"}
         # in-competition → route 必須
         if not route:
-            opts = str(pr.permitted_route).split(';') if pr.permitted_route else []
+            opts = str(pr["permitted_route"]).split(';') if pr["permitted_route"] else []
             return _ask([{"field":"route","options":opts or None,"hint":"Select administration route"}],
                         "yellow","In-competition requires route decision")
-        red_routes = set(str(pr.prohibited_route).split(';')) if pr.prohibited_route else set()
+        red_routes = set(str(pr["prohibited_route"]).split(';')) if pr["prohibited_route"] else set()
         if route in red_routes:
             return {"status":"final","color":"red","reason":"Prohibited route in-competition"}
         return {"status":"final","color":"green","reason":"Permitted route in-competition"}
 
     # 5) ask_period_and_urine_caution (S6 thresholds)
-    row = df["period_urine"][df["period_urine"]["inn"] == t]
-    if not row.empty:
+    rec = IDX["period_urine"].get(t)
+    if rec is not None:
         if period is None:
             return _ask([{"field":"period","options":["in","out"],"hint":"In-competition?"}],
                         "yellow","Urine threshold rule")
         if period == "in":
-            th = int(row.urine_threshold_ng_ml.iloc[0])
+            th = int(rec["urine_threshold_ng_ml"])
             return {"status":"final","color":"yellow","reason":f"In-competition urine > {th} ng/mL ⇒ AAF"}
         return {"status":"final","color":"green","reason":"Out-of-competition allowed"}
 
     # 6) always red
-    if not df["red"][df["red"]["inn"] == t].empty:
+    if t in IDX["red"]:
         return {"status":"final","color":"red","reason":"Always prohibited"}
 
     # ---------- 3. cache & API fallback ----------
     # 3-1 substances_cache
-    row = df["cache_sub"][df["cache_sub"]["inn"] == t]
-    if not row.empty:
-        return _section_fallback(row.atc_code.iloc[0], period, route)
+    rec = IDX["cache_sub"].get(t)
+    if rec is not None:
+        return _section_fallback(rec["atc_code"], period, route)
     
     # 3-2 product_compositions (brand)
-    res_brand = _handle_product_brand(t, sport_code, period, route, dose_24h)
+    res_brand = _handle_product_brand(t, sport_code, period, route, dose_24h, _depth)
     if res_brand is not None:
         return res_brand
 
@@ -270,13 +392,7 @@ def _section_fallback(atc_code, period, route):
     code = str(atc_code).strip().upper()
 
     # a) sections.csv: 最長一致でセクション特定
-    section = None
-    matched_prefix = None
-    for p in SECTIONS_PREFIXES_SORTED:
-        if code.startswith(p):
-            section = SECTIONS_PREFIX_MAP[p]
-            matched_prefix = p
-            break
+    matched_prefix, section = _longest_prefix(SECTIONS_TRIE, code)
 
     if section:
         if section in ("S1","S2","S3","S4","S5"):
@@ -291,9 +407,9 @@ def _section_fallback(atc_code, period, route):
             return {"status":"final","color":"green", "reason":f"S9 permitted (ATC {matched_prefix})"}
 
     # b) allowed_atc_code_prefix.csv: 最長一致で許可
-    for p in ALLOWED_PREFIXES_SORTED:
-        if code.startswith(p):
-            return {"status":"final","color":"green","reason":f"Allowed ATC class ({p})"}
+    p, _ = _longest_prefix(ALLOWED_TRIE, code)
+    if p:
+        return {"status":"final","color":"green","reason":f"Allowed ATC class ({p})"}
 
     # c) どちらにも無い → S0相当
     return {"status":"final","color":"red","reason":"Unknown ATC class (S0-like)"}
@@ -313,21 +429,46 @@ def _split_semicol(s: str):
 def _split_semicol(s: str):
     return [x.strip().lower() for x in str(s).split(";") if str(x).strip()]
 
-def _handle_product_brand(t, sport_code, period, route, dose_24h):
-    cp = df["cache_prod"]
-    row = cp[cp["brand_name"].str.lower().str.strip() == t]
-    if row.empty:
-        return None  # キャッシュ未ヒット→後段の RxNorm へ
+def _is_local(inn):
+    """CSV（IDX / BRAND_IDX）だけで判定できる成分か（RxNav を呼ばない）"""
+    t = norm(inn)
+    return t in BRAND_IDX or any(t in idx for idx in IDX.values())
 
-    inns = [s.strip().lower() for s in str(row.iloc[0]["list_name"]).split(";") if s.strip()]
+def _is_hard_red(r):
+    return r.get("status") != "ask" and r["color"] == "red" and "S0" not in r.get("reason","")
+
+def _handle_product_brand(t, sport_code, period, route, dose_24h, depth=0):
+    inns = BRAND_IDX.get(t)
+    if inns is None:
+        return None  # キャッシュ未ヒット→後段の RxNorm へ
 
     final_color = "green"
     reasons, needs = [], []
     unknown_components = []  # S0（未承認/未特定）をここで一旦保留
 
-    for inn in inns:
-        r = judge(inn, sport_code=sport_code, period=period, route=route, dose_24h=dose_24h)
+    def _judge_in(inn):
+        return judge(inn, sport_code=sport_code, period=period, route=route, dose_24h=dose_24h, _depth=depth+1)
 
+    # CSV で引ける成分を先に順番に判定し、“真っ赤”があれば RxNav を待たずに終了
+    results, remote = {}, []
+    for i, inn in enumerate(inns):
+        if not _is_local(inn):
+            remote.append(i)
+            continue
+        r = _judge_in(inn)
+        if _is_hard_red(r):
+            return r
+        results[i] = r
+    # 残り（RxNav 行き）は往復待ちが重なるようスレッドで並行実行（1件だけならその場で判定）
+    if len(remote) == 1:
+        results[remote[0]] = _judge_in(inns[remote[0]])
+    elif remote:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(remote))) as ex:
+            results.update(zip(remote, ex.map(lambda i: _judge_in(inns[i]), remote)))
+
+    # 集約は成分順のまま
+    for i, inn in enumerate(inns):
+        r = results[i]
         # 追加質問が必要なものは ask を集約
         if r.get("status") == "ask":
             needs += r["need"]
@@ -0,0 +1,31 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def J(tmp_path_factory):
+    """ scripts.judge は import 時に DATA_DIR の CSV を読むので、空ディレクトリを指して import する。
+    RxNav のディスクキャッシュも既定（無効）のまま """
+    mp = pytest.MonkeyPatch()
+    mp.setenv("CLEATHLETE_DATA_DIR", str(tmp_path_factory.mktemp("data")))
+    mp.delenv("CLEATHLETE_RXNAV_CACHE", raising=False)
+    try:
+        yield importlib.import_module("scripts.judge")
+    finally:
+        mp.undo()
+
+
+@pytest.fixture(scope="session")
+def L():
+    """ scripts.judge_legacy は import 時に CSV 一式を読むので、tests/data/legacy を指して import する """
+    mp = pytest.MonkeyPatch()
+    mp.setenv("CLEATHLETE_LEGACY_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "legacy"))
+    try:
+        yield importlib.import_module("scripts.judge_legacy")
+    finally:
+        mp.undo()
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+@pytest.fixture(scope="module")
+def engine(J):
+    """ tests/data の小さな CSV 一式で load_data し、終わったら元の DATA_DIR で読み直す """
+    mp = pytest.MonkeyPatch()
+    mp.setattr(J, "DATA_DIR", DATA)
+    J.load_data()
+    yield J
+    mp.undo()
+    J.load_data()
+
+
+@pytest.fixture
+def offline(engine, monkeypatch):
+    # requests が無い環境と同じ扱い（外部照会せず S0）
+    monkeypatch.setattr(engine, "_session", lambda: None)
+    return engine
+
+
+def _summary(res):
+    return res["status"], res.get("color", res.get("provisional_color")), res["reason"]
+
+
+NOT_FOUND = ("final", "red", "Not found (S0). Possibly unapproved.")
+
+
+@pytest.mark.parametrize("term, kwargs, expected", [
+    # 正規化と別名
+    ("glucose", {}, ("final", "green", "Always allowed.")),
+    ("  GLUCOSE ", {}, ("final", "green", "Always allowed.")),
+    ("dextrose", {}, ("final", "green", "Always allowed.")),
+    # 同じテーブル内の重複は先頭行
+    ("firstrow", {}, ("final", "green", "Always allowed (A).")),
+    # 6CSV の優先順（上のテーブルが勝つ）
+    ("shared", {}, ("final", "green", "Always allowed.")),                         # always_green > always_red
+    ("tiered", {}, ("final", "red", "Always prohibited (S1).")),                   # always_red > ask_route_and_dose
+    ("salbutamol", {}, ("ask", "yellow", "Route and/or dose required.")),          # ask_route_and_dose > ask_period
+    ("albuterol", {"route": "inhaled", "dose_24h": 800}, ("final", "green", "Within permitted route/dose.")),
+    ("cocaine", {"period": "in"}, ("final", "red", "S6 period rule.")),            # ask_period > ask_period_and_route
+    ("prednisolone", {"period": "in", "route": "oral"},                            # ask_period_and_route > urine（S9 既定経路）
+     ("final", "red", "Prohibited route in-competition.")),
+    ("pseudoephedrine", {"period": "in"},                                          # urine > substances_cache
+     ("final", "yellow", "Urine threshold caution applies in-competition.")),
+    # substances_cache > product_compositions、sports_rules は先頭行（"arch " → ARCH）
+    ("bisoprolol", {"sport_code": "arch"}, ("final", "red", "P1 prohibited in this sport (both).")),
+    ("bisoprolol", {"sport_code": "GOLF"}, ("ask", "yellow", "Period required for P1.")),
+    ("bisoprolol", {"period": "out"}, ("final", "green", "P1 period rule.")),     # 未登録の競技は in ルール
+    ("atenolol", {}, ("final", "red", "Unknown/Unapproved (S0) via cache.")),
+    # substances_cache の section が空 → ブランド表へ落ちる
+    ("blankcache", {"period": "out"}, ("final", "green", "glucose: Always allowed. / cocaine: S6 period rule.")),
+    ("Ventolin", {}, ("ask", "yellow", "salbutamol: needs route, dose_24h")),
+    ("mixred", {}, ("final", "red", "Always prohibited (S1).")),
+    # どこにも無い／section が想定外 → 外部照会なしなら S0
+    ("oddsection", {}, NOT_FOUND),
+    ("nowhere", {}, NOT_FOUND),
+])
+def test_dispatch_table(offline, term, kwargs, expected):
+    kwargs.setdefault("sport_code", "GEN")
+    assert _summary(offline.judge(term, **kwargs)) == expected
+
+
+@pytest.mark.parametrize("term, via_external", [
+    ("nowhere", True),
+    ("oddsection", True),
+    ("blankcache", False),
+    ("glucose", False),
+])
+def test_unresolved_terms_fall_through_to_external(engine, monkeypatch, term, via_external):
+    calls = []
+
+    def _external(term_norm, *args):
+        calls.append(term_norm)
+        return engine._out("green", "external")
+
+    monkeypatch.setattr(engine, "_session", lambda: object())
+    monkeypatch.setattr(engine, "_judge_by_external", _external)
+    res = engine.judge(term, sport_code="GEN", period="out")
+    assert (calls == [term]) is via_external
+    assert (res["reason"] == "external") is via_external
@@ -0,0 +1,92 @@
+import random
+import re
+
+import pytest
+
+
+def _scan_longest_prefix(prefix_to_value, code):
+    """ trie 導入前の探索（長い順に並べて最初の startswith） """
+    for p in sorted(prefix_to_value, key=len, reverse=True):
+        if code.startswith(p):
+            return p, prefix_to_value[p]
+    return None, None
+
+
+NESTED = {"R": "r", "R03": "r03", "R03AC": "r03ac", "A10": "a10"}
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("R03AC02", ("R03AC", "r03ac")),   # 入れ子は一番長いもの
+    ("R03AC", ("R03AC", "r03ac")),     # 完全一致
+    ("R03BA02", ("R03", "r03")),       # 途中で枝が切れたら直前の終端
+    ("R03A", ("R03", "r03")),
+    ("R01", ("R", "r")),
+    ("A10BA02", ("A10", "a10")),
+    ("A1", (None, None)),              # 終端に届かない
+    ("N02BE01", (None, None)),         # 先頭から外れる
+    ("", (None, None)),
+])
+def test_longest_prefix_nested(L, code, expected):
+    trie = L._build_prefix_trie(NESTED)
+    assert L._longest_prefix(trie, code) == expected
+    assert _scan_longest_prefix(NESTED, code) == expected
+
+
+def test_longest_prefix_matches_old_scan_randomized(L):
+    rng = random.Random(0)
+    alphabet = "AR0123"
+    for _ in range(200):
+        prefixes = {"".join(rng.choices(alphabet, k=rng.randint(1, 5))): i for i in range(rng.randint(0, 12))}
+        trie = L._build_prefix_trie(prefixes)
+        for _ in range(50):
+            code = "".join(rng.choices(alphabet, k=rng.randint(0, 7)))
+            assert L._longest_prefix(trie, code) == _scan_longest_prefix(prefixes, code)
+
+
+def test_module_tries_match_prefix_tables(L):
+    for code in ("R03AC02", "R03BA02", "R03DA04", "C07AB07", "C09AA05", "H02AB06", "A10BA02", "N02BE01"):
+        assert L._longest_prefix(L.SECTIONS_TRIE, code) == _scan_longest_prefix(L.SECTIONS_PREFIX_MAP, code)
+        allowed = {p: p for p in L.ALLOWED_PREFIX_SET}
+        assert L._longest_prefix(L.ALLOWED_TRIE, code) == _scan_longest_prefix(allowed, code)
+
+
+SALT_REGEX = re.compile(r'\b(hydrochloride|bromide|sulfate|tartrate|maleate|hydrate)\b', re.I)
+SPACE_REGEX = re.compile(r'\s+')
+
+
+def _multipass_norm(term):
+    """ 1回の sub にする前の norm（lower/strip → 塩名除去 → strip → 空白の連なりを1つに） """
+    term = term.lower().strip()
+    term = SALT_REGEX.sub('', term).strip()
+    return SPACE_REGEX.sub(' ', term)
+
+
+@pytest.mark.parametrize("term, expected", [
+    ("Salbutamol Sulfate", "salbutamol"),
+    ("  salbutamol   SULFATE  ", "salbutamol"),
+    ("Morphine\tsulfate\n", "morphine"),
+    ("ipratropium bromide hydrate", "ipratropium"),
+    ("a hydrochloride b", "a b"),                       # 塩名を挟んだ空白は1つに
+    ("a  \t b", "a b"),
+    ("Sulfate", ""),
+    ("", ""),
+    ("monohydrate", "monohydrate"),                     # 語の途中は塩名扱いしない
+    ("hydrochloridehydrate", "hydrochloridehydrate"),
+    ("sulfates", "sulfates"),
+    ("hydrochloride-free", "-free"),                    # '-' は語境界
+    ("Co-trimoxazole", "co-trimoxazole"),
+    ("x\u00a0sulfate", "x"),                      # \s / strip() は NBSP などの Unicode 空白も含む
+])
+def test_norm_tricky_inputs(L, term, expected):
+    assert L.norm(term) == expected
+    assert _multipass_norm(term) == expected
+
+
+def test_norm_matches_multipass_randomized(L):
+    rng = random.Random(0)
+    tokens = ["salbutamol", "Sulfate", "HYDROCHLORIDE", "bromide", "tartrate", "maleate", "hydrate",
+              "monohydrate", "sulfates", "a", "B", "-", "(", ")", "2", "_"]
+    seps = ["", " ", "  ", "\t", "\n", " \t ", "\u00a0"]
+    for _ in range(5000):
+        term = "".join(rng.choice(seps) + rng.choice(tokens) for _ in range(rng.randint(0, 6))) + rng.choice(seps)
+        assert L.norm(term) == _multipass_norm(term), repr(term)
@@ -0,0 +1,117 @@
+import pytest
+
+
+class _Resp:
+    def __init__(self, js):
+        self._js = js
+
+    def json(self):
+        return self._js
+
+
+class _StubSession:
+    """ RxNav の代わり。rxcui.json は ids に載っている名前だけ見つかる """
+
+    def __init__(self, ids=None, fail=False):
+        self.ids = ids or {}
+        self.fail = fail
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(url)
+        if self.fail:
+            raise ConnectionError("rxnav down")
+        if url.endswith("/rxcui.json"):
+            name = params["name"]
+            return _Resp({"idGroup": {"rxnormId": [self.ids[name]]} if name in self.ids else {}})
+        if url.endswith("/approximateTerm.json"):
+            return _Resp({"approximateGroup": {}})
+        raise AssertionError(url)
+
+
+@pytest.fixture
+def cache(J, tmp_path, monkeypatch):
+    monkeypatch.setattr(J, "RXNAV_CACHE_PATH", str(tmp_path / "rxnav.sqlite3"))
+    monkeypatch.setattr(J, "_cache_conn", None)
+    monkeypatch.setattr(J, "_memo", {})
+    yield tmp_path
+    if J._cache_conn is not None:
+        J._cache_conn.close()
+
+
+@pytest.fixture
+def session(J, monkeypatch):
+    s = _StubSession(ids={"salbutamol": "9648"})
+    monkeypatch.setattr(J, "SESSION", s)
+    return s
+
+
+def _advance(J, monkeypatch, seconds):
+    now = J.time.time()
+    monkeypatch.setattr(J.time, "time", lambda: now + seconds)
+
+
+def test_disk_cache_is_opt_in(J, monkeypatch, tmp_path):
+    # conftest は CLEATHLETE_RXNAV_CACHE を外して import している
+    assert J.RXNAV_CACHE_PATH == ""
+    monkeypatch.setattr(J, "_memo", {})
+    monkeypatch.chdir(tmp_path)
+    assert J._cache_db() is None
+    J._cache_put("rxcui:x", "1")
+    assert J._cache_get("rxcui:x") == "1"   # プロセス内には残る
+    assert list(tmp_path.iterdir()) == []   # ファイルは作らない
+
+
+def test_put_get_roundtrip_through_sqlite(J, cache):
+    J._cache_put("related_in:1", [{"inn": "a", "rxcui": "2"}])
+    J._memo.clear()
+    assert J._cache_get("related_in:1") == [{"inn": "a", "rxcui": "2"}]
+    assert (cache / "rxnav.sqlite3").exists()
+
+
+def test_miss_sentinel_differs_from_cached_not_found(J, cache):
+    assert J._cache_get("rxcui:unknown") is J._MISS
+    J._cache_put("rxcui:unknown", None)
+    J._memo.clear()
+    assert J._cache_get("rxcui:unknown") is None
+
+
+@pytest.mark.parametrize("drop_memo", [False, True])
+def test_negative_results_expire_before_positive(J, cache, monkeypatch, drop_memo):
+    J._cache_put("rxcui:hit", "1")
+    J._cache_put("rxcui:nothing", None)
+    if drop_memo:
+        J._memo.clear()
+
+    _advance(J, monkeypatch, J.RXNAV_NEG_CACHE_TTL + 1)
+    assert J._cache_get("rxcui:hit") == "1"
+    assert J._cache_get("rxcui:nothing") is J._MISS
+
+    _advance(J, monkeypatch, J.RXNAV_CACHE_TTL + 1)
+    assert J._cache_get("rxcui:hit") is J._MISS
+
+
+def test_lookup_is_served_from_cache(J, cache, session):
+    assert J._rxnorm_find_rxcui("salbutamol") == "9648"
+    assert J._rxnorm_find_rxcui("salbutamol") == "9648"
+    J._memo.clear()
+    assert J._rxnorm_find_rxcui("salbutamol") == "9648"
+    assert len(session.calls) == 1
+
+
+def test_not_found_is_cached(J, cache, session):
+    assert J._rxnorm_find_rxcui("nothing") is None
+    n = len(session.calls)
+    assert J._rxnorm_find_rxcui("nothing") is None
+    assert len(session.calls) == n
+
+
+def test_network_errors_are_not_cached(J, cache, session):
+    session.fail = True
+    assert J._rxnorm_find_rxcui("salbutamol") is None
+    assert J._rxnorm_related_in("9648") == []
+    assert J._cache_get("rxcui:salbutamol") is J._MISS
+    assert J._cache_get("related_in:9648") is J._MISS
+
+    session.fail = False
+    assert J._rxnorm_find_rxcui("salbutamol") == "9648"